@@ -1,21 +1,25 @@
+from __future__ import annotations
+
 import os
 import time
-import json
+import hashlib
 import logging
+import re
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from typing import List, Dict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List
 
-import requests
-from bs4 import BeautifulSoup
+import orjson
 
-# Selenium 4+ с Selenium Manager (без ручного chromedriver)
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+# requests / selectolax / selenium импортируем там, где они нужны:
+# прогон без изменений (HTML-хэш совпал) не тащит сотни модулей
+if TYPE_CHECKING:
+    import requests
+    from selenium import webdriver
 
 
 # ---------- настройки / окружение ----------
@@ -26,6 +30,9 @@ logging.basicConfig(
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "").strip()
+TELEGRAM_ENABLED = bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
+if not TELEGRAM_ENABLED:
+    logging.warning("TELEGRAM_* не заданы — уведомления отправляться не будут.")
 
 LOGIN_URL = os.getenv(
     "LOGIN_URL",
@@ -36,198 +43,714 @@ TARGET_URL = os.getenv(
     "https://f-okno.ru/base/moscovskaya_oblast/sizo11noginsk",
 )
 STATE_FILE = os.getenv("STATE_FILE", "state_sizo11.json")
+# хэш сырого HTML прошлого прогона: совпал — парсить нечего
+HTML_HASH_FILE = os.getenv("HTML_HASH_FILE", STATE_FILE + ".htmlhash")
+# 1 = дополнительно писать полный JSON слотов рядом (для разборов)
+DEBUG_STATE = os.getenv("DEBUG_STATE", "0") == "1"
+# свободные даты прошлого прогона (по одной в строке): уведомляем только о новых
+FREE_DATES_FILE = os.getenv("FREE_DATES_FILE", STATE_FILE + ".free")
+# 1 = для отладки: page.html при изменении снимка и скриншот page.png при ошибке
+# (по умолчанию на диск пишется только page.html при ошибке)
+SAVE_PAGE_HTML = os.getenv("SAVE_PAGE_HTML", "0") == "1"
+# >0 — жить процессом и проверять раз в N секунд на одном Chrome; 0 — одна проверка (cron)
+CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "0"))
+LOGIN_EMAIL = os.getenv("LOGIN_EMAIL", "").strip()
+LOGIN_PASSWORD = os.getenv("LOGIN_PASSWORD", "").strip()
+# 1 = сначала тянем HTML обычным HTTP, Chrome — только если разметки нет
+USE_REQUESTS = os.getenv("USE_REQUESTS", "1") == "1"
+# куки HTTP-сессии между запусками: пока живы, логиниться заново не нужно
+COOKIES_FILE = os.getenv("COOKIES_FILE", "cookies_f_okno.txt")
+# 1 = уведомлять только о датах, освободившихся с прошлого прогона; 0 = о любом изменении снимка
 ONLY_NOTIFY_WHEN_FREE = os.getenv("ONLY_NOTIFY_WHEN_FREE", "1") == "1"
 
+# профиль и дисковый кэш Chrome переживают прогоны: куки, HTTP-кэш, TLS-сессии
+CHROME_PROFILE_DIR = os.getenv("CHROME_PROFILE_DIR", "/tmp/f-okno-profile")
+CHROME_CACHE_DIR = os.getenv("CHROME_CACHE_DIR", "/tmp/f-okno-cache")
+# готовый chromedriver: без него Selenium Manager ищет/качает драйвер на каждом запуске
+CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH", "").strip()
+# бинарник Chrome; с CHROMEDRIVER_PATH Selenium Manager его уже не ищет
+CHROME_PATH = os.getenv("CHROME_PATH", "").strip()
+# уже запущенный chromedriver (`chromedriver --port=9515`): не поднимаем драйвер на каждый прогон
+CHROMEDRIVER_URL = os.getenv("CHROMEDRIVER_URL", "").strip()
+
 MOSCOW_TZ = ZoneInfo("Europe/Moscow")
 
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0 Safari/537.36"
+)
+# контейнер сетки дат: есть в серверном HTML, если страница отдалась целиком
+SLOTS_CONTAINER = "graphic_container"
+# карточка даты в сетке f-okno: дата и статус лежат в отдельных узлах
+GRAPHIC_ITEM_SEL = f"#{SLOTS_CONTAINER} .graphic_item"
+GRAPHIC_DATE_SEL = ".graphic_item_date"
+GRAPHIC_STATUS_SEL = ".graphic_item_slots"
+# карточки дат в прочих вариантах верстки (при необходимости подточить)
+SLOT_CARDS_SEL = ".calendar .day, .calendar .item, .slots-list .slot, .day-item"
+# признак свободной даты и маркеры статуса, которые вычищаем из текста даты
+FREE_RE = re.compile(r"Есть места|Доступно|Свобод")
+# признак занятой даты — проверяем раньше FREE_RE: "Свободных мест нет" тоже содержит "Свобод"
+BUSY_RE = re.compile(r"[Нн]ет (?:свободных )?мест|мест нет|Недоступно")
+MARKERS_RE = re.compile(r"Есть места|Нет мест")
+# скрипты/стили/шаблоны: парсеру не нужны, их текст не должен попасть в fallback
+NOISE_RE = re.compile(r"<(script|style|template)\b[^>]*>.*?</\1\s*>", re.S | re.I)
+# дата в карточке — кусок до двойного пробела или до конца строки
+DATE_SPLIT_RE = re.compile(r"  |\n")
+# fallback по тексту: сразу выбираем только строки со статусом
+STATUS_LINE_RE = re.compile(r"^.*(?:Есть места|Свобод|Нет мест).*$", re.M)
+LINE_FREE_RE = re.compile(r"Есть места|Свобод")
+# поля формы логина: куда класть почту и какие галочки "запомнить" отмечать
+LOGIN_FIELD_RE = re.compile(r"login|e-?mail|user", re.I)
+REMEMBER_RE = re.compile(r"remember|запомн", re.I)
+# открывающий тег контейнера сетки дат в сыром HTML
+CONTAINER_OPEN_RE = re.compile(
+    r"<([a-z][a-z0-9]*)\b[^>]*(?<![\w-])id\s*=\s*[\"']?" + SLOTS_CONTAINER + r"(?![\w-])", re.I
+)
+
+# подресурсы, которые парсеру не нужны — режем через CDP, чтобы не качать их
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg",
+    "*.woff", "*.woff2", "*.ttf", "*.mp4", "*.css",
+    "*googletagmanager*",
+    "*google-analytics*",
+    "*yandex*",
+]
+
+
+@dataclass(slots=True, frozen=True)
+class Slot:
+    """Дата приёма и её статус: "Свободно" | "Нет мест"."""
+    date: str
+    status: str
+
 
 # ---------- утилиты ----------
+_TG_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+_TG_SESSION = None
+_TG_POOL = None
+_TG_WARMED = False
+
+
+def tg_session() -> requests.Session:
+    """Одно keep-alive соединение к api.telegram.org на процесс."""
+    global _TG_SESSION
+    if _TG_SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry
+
+        # повторяем только неудачное соединение: запрос до Telegram не дошёл.
+        # Таймаут чтения и 5xx (502/504 от шлюза) — нет: сообщение могло уже уйти,
+        # повтор дал бы дубль. 429 разбирает send_tg по retry_after из тела ответа
+        retry = Retry(
+            total=3,
+            connect=3,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=1.5,
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        _TG_SESSION = requests.Session()
+        _TG_SESSION.headers["Connection"] = "keep-alive"
+        # одного сокета хватает: прогрев и отправки идут по очереди через tg_pool
+        _TG_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry))
+    return _TG_SESSION
+
+
+def tg_pool() -> ThreadPoolExecutor:
+    """
+    Один фоновый поток для всего, что ходит в Telegram: запросы идут по очереди
+    (сессию не делим между потоками), а основной прогон их не ждёт.
+    При выходе интерпретатор дожидается очереди сам.
+    """
+    global _TG_POOL
+    if _TG_POOL is None:
+        _TG_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tg")
+    return _TG_POOL
+
+
+def warm_tg() -> None:
+    """
+    Фоном открываем TLS-соединение к Telegram, пока грузится страница —
+    send_tg потом идёт по уже готовому keep-alive сокету.
+    """
+    global _TG_WARMED
+    if not TELEGRAM_ENABLED or _TG_WARMED:
+        return
+    _TG_WARMED = True
+
+    def _go() -> None:
+        from urllib3.util import Retry
+
+        # прогрев — без повторов и с коротким таймаутом: недоступный Telegram
+        # не должен держать процесс на выходе (поток tg не daemon).
+        # Адаптер подменять безопасно: в tg-потоке запросы идут по одному
+        s = tg_session()
+        adapter = s.get_adapter("https://api.telegram.org/")
+        retries, adapter.max_retries = adapter.max_retries, Retry(0, read=False)
+        try:
+            s.head("https://api.telegram.org/", timeout=3)
+        except Exception:
+            logging.debug("Telegram warm-up failed", exc_info=True)
+        finally:
+            adapter.max_retries = retries
+
+    tg_pool().submit(_go)
+
+
 def send_tg(text: str) -> None:
     """Отправка сообщения в Telegram (HTML)."""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        logging.warning("TELEGRAM_* не заданы — сообщение не отправлено.")
+    if not TELEGRAM_ENABLED:
         return
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
+    # тело собираем один раз (orjson), при повторе после 429 шлём те же байты
+    body = orjson.dumps({
         "chat_id": TELEGRAM_CHAT_ID,
         "text": text,
         "parse_mode": "HTML",
         "disable_web_page_preview": True,
-    }
+    })
+    headers = {"Content-Type": "application/json"}
     try:
-        r = requests.post(url, json=payload, timeout=15)
+        r = tg_session().post(_TG_URL, data=body, headers=headers, timeout=(5, 15))
+        if r.status_code == 429:
+            # Telegram кладёт паузу в тело ответа: {"parameters": {"retry_after": N}}
+            try:
+                retry_after = int(r.json()["parameters"]["retry_after"])
+            except Exception:
+                retry_after = 5
+            logging.warning("Telegram 429, ждём %s с", retry_after)
+            time.sleep(retry_after + 1)
+            r = tg_session().post(_TG_URL, data=body, headers=headers, timeout=(5, 15))
         if r.status_code != 200:
             logging.warning("Telegram send failed: %s %s", r.status_code, r.text[:200])
     except Exception:
         logging.exception("Telegram send exception")
 
 
-def load_last_snapshot() -> str:
+def send_tg_background(text: str) -> None:
+    """send_tg в фоновом потоке: закрытие Chrome и запись состояния не ждут сеть."""
+    if TELEGRAM_ENABLED:
+        tg_pool().submit(send_tg, text)
+
+
+def digest(data: bytes) -> str:
+    """Короткий отпечаток (BLAKE2b, 16 байт) — хранить и сравнивать вместо содержимого."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def snapshot_key(slots: List[Slot]) -> str:
+    """Отпечаток набора (дата, статус): без JSON и не зависит от порядка карточек в DOM."""
+    return digest("\n".join(sorted(f"{s.date}|{s.status}" for s in slots)).encode("utf-8"))
+
+
+def load_state(path: str) -> str:
+    """Читаем однострочный файл состояния; нет файла — пустая строка."""
     try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            return f.read()
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
     except FileNotFoundError:
         return ""
     except Exception:
-        logging.exception("load_last_snapshot failed")
+        logging.exception("load_state failed: %s", path)
         return ""
 
 
-def save_snapshot(snapshot: str) -> None:
+def save_state(path: str, value: str) -> None:
+    """Пишем во временный файл и подменяем атомарно — упавший прогон не оставит обрывок."""
+    tmp = path + ".tmp"
     try:
-        with open(STATE_FILE, "w", encoding="utf-8") as f:
-            f.write(snapshot)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp, path)
     except Exception:
-        logging.exception("save_snapshot failed")
+        logging.exception("save_state failed: %s", path)
 
 
-def format_slots(slots: List[Dict], only_available: bool = True) -> str:
+def format_slots(slots: List[Slot], only_available: bool = True) -> str:
     """Форматируем даты списком (только свободные — по умолчанию)."""
-    if not slots:
-        return "Свободных дат нет."
-
-    filtered = [s for s in slots if s.get("status") == "Свободно"] if only_available else slots
-    if not filtered:
-        return "Свободных дат нет."
-
-    lines = []
-    for s in filtered:
-        d = (s.get("date") or "").strip()
-        if not d:
-            continue
-        # галочка и жирный
-        lines.append(f"✅ <b>{d}</b>")
+    # один проход: фильтр по статусу и пустым датам; галочка и жирный
+    lines = [
+        f"✅ <b>{d}</b>"
+        for s in slots
+        if (not only_available or s.status == "Свободно") and (d := s.date.strip())
+    ]
     return "\n".join(lines) if lines else "Свободных дат нет."
 
 
+# ---------- HTTP ----------
+_HTTP_SESSION = None
+# набор кук на момент загрузки/последней записи COOKIES_FILE
+_COOKIES_SAVED: frozenset = frozenset()
+
+
+def cookies_key(jar) -> frozenset:
+    """Отпечаток кук для сравнения в памяти: без сериализации на диск."""
+    return frozenset((c.domain, c.path, c.name, c.value, c.expires) for c in jar)
+
+
+def http_session() -> requests.Session:
+    """Одна сессия на процесс: keep-alive и куки между опросами (и запусками — через COOKIES_FILE)."""
+    global _HTTP_SESSION, _COOKIES_SAVED
+    if _HTTP_SESSION is None:
+        import requests
+        from http.cookiejar import MozillaCookieJar
+
+        _HTTP_SESSION = requests.Session()
+        _HTTP_SESSION.headers.update({"User-Agent": USER_AGENT})
+        jar = MozillaCookieJar(COOKIES_FILE)
+        try:
+            jar.load(ignore_discard=True, ignore_expires=True)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logging.exception("cookies load failed")
+        _HTTP_SESSION.cookies = jar
+        _COOKIES_SAVED = cookies_key(jar)
+    return _HTTP_SESSION
+
+
+def save_cookies() -> None:
+    """Куки на диск — только если набор поменялся (тихий прогон диск не трогает)."""
+    global _COOKIES_SAVED
+    jar = http_session().cookies
+    key = cookies_key(jar)
+    if key == _COOKIES_SAVED:
+        return
+    tmp = COOKIES_FILE + ".tmp"
+    try:
+        jar.save(tmp, ignore_discard=True, ignore_expires=True)
+        os.replace(tmp, COOKIES_FILE)
+        _COOKIES_SAVED = key
+    except Exception:
+        logging.exception("cookies save failed")
+
+
+def http_login(s: requests.Session) -> None:
+    """
+    Логин обычной формой: берём со страницы логина скрытые поля (CSRF и т.п.)
+    и action формы, подставляем почту/пароль, постим.
+    """
+    from urllib.parse import urljoin
+    from selectolax.lexbor import LexborHTMLParser
+
+    r = s.get(LOGIN_URL, timeout=15)
+    form = None
+    for f in LexborHTMLParser(r.text).css("form"):
+        if f.css_first("input[type=password]") is not None:
+            form = f
+            break
+    if form is None:
+        logging.warning("HTTP login: на странице нет формы с паролем")
+        return
+
+    inputs = [
+        (inp.attributes.get("name"), (inp.attributes.get("type") or "text").lower(), inp)
+        for inp in form.css("input[name]")
+    ]
+    # почту кладём в одно поле: с именем login/email, иначе в первое текстовое
+    # (капча/телефон/имя в той же форме почту получить не должны)
+    text_names = [name for name, kind, _ in inputs if kind in ("email", "text")]
+    login_name = next((n for n in text_names if LOGIN_FIELD_RE.search(n)), None)
+    if login_name is None and text_names:
+        login_name = text_names[0]
+
+    data = {}
+    for name, kind, inp in inputs:
+        value = inp.attributes.get("value") or ""
+        if kind == "password":
+            data[name] = LOGIN_PASSWORD
+        elif name == login_name:
+            data[name] = LOGIN_EMAIL
+        elif kind == "checkbox":
+            # "запомнить меня" — чтобы сессионная кука жила и сохранялась в COOKIES_FILE
+            if "checked" in inp.attributes or REMEMBER_RE.search(name):
+                data[name] = value or "on"
+        elif kind not in ("submit", "button", "radio"):
+            data[name] = value
+    action = urljoin(r.url, form.attributes.get("action") or "")
+    s.post(action, data=data, timeout=15)
+
+
+def fetch_html_requests() -> str:
+    """
+    Забираем страницу без браузера. Сначала пробуем с сохранёнными куками,
+    логинимся только если сетки дат нет.
+    Возвращаем "" если не вышло — тогда идём через Selenium.
+    """
+    s = http_session()
+    try:
+        r = s.get(TARGET_URL, timeout=15)
+        if not CONTAINER_OPEN_RE.search(r.text) and LOGIN_EMAIL and LOGIN_PASSWORD:
+            http_login(s)
+            r = s.get(TARGET_URL, timeout=15)
+    except Exception:
+        logging.exception("HTTP fetch failed")
+        return ""
+    if r.status_code != 200 or not CONTAINER_OPEN_RE.search(r.text):
+        logging.warning("HTTP fetch: нет %s (status %s) — fallback на Selenium", SLOTS_CONTAINER, r.status_code)
+        return ""
+    save_cookies()
+    return container_html(r.text)
+
+
+def container_html(html: str) -> str:
+    """
+    Вырезаем из сырого HTML только поддерево контейнера с датами
+    (один проход regex по тегам, без построения дерева) — то же, что page_html
+    отдаёт из Chrome. Не нашли/не сошлись теги — весь документ.
+    """
+    m = CONTAINER_OPEN_RE.search(html)
+    if not m:
+        return html
+    tag_re = re.compile(rf"<(/?){m.group(1)}\b", re.I)
+    depth = 0
+    for t in tag_re.finditer(html, m.start()):
+        depth += -1 if t.group(1) else 1
+        if depth == 0:
+            end = html.find(">", t.end())
+            if end != -1:
+                return html[m.start():end + 1]
+            break
+    return html
+
+
 # ---------- Selenium ----------
-def make_driver() -> webdriver.Chrome:
-    """Запускаем Chrome; Selenium Manager сам подберёт chromedriver."""
+def make_driver() -> webdriver.Remote:
+    """Запускаем Chrome; без CHROMEDRIVER_PATH Selenium Manager сам подберёт chromedriver."""
+    # Selenium 4+ с Selenium Manager (без ручного chromedriver)
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+
     opts = Options()
+    if CHROME_PATH:
+        opts.binary_location = CHROME_PATH
     opts.add_argument("--headless=new")
     opts.add_argument("--no-sandbox")
     opts.add_argument("--disable-dev-shm-usage")
-    # НИЧЕГО не передаём про путь к chromedriver
-    return webdriver.Chrome(service=Service(), options=opts)
-
-
-def login(driver: webdriver.Chrome) -> None:
+    opts.add_argument(f"--user-data-dir={CHROME_PROFILE_DIR}")
+    opts.add_argument(f"--disk-cache-dir={CHROME_CACHE_DIR}")
+    # парсеру нужен только HTML: не ждём картинки/шрифты/аналитику (DOMContentLoaded)
+    opts.page_load_strategy = "eager"
+    # картинки не декодируем вовсе
+    opts.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    if CHROMEDRIVER_URL:
+        drv = webdriver.Remote(command_executor=CHROMEDRIVER_URL, options=opts)
+    else:
+        service = Service(executable_path=CHROMEDRIVER_PATH) if CHROMEDRIVER_PATH else Service()
+        drv = webdriver.Chrome(service=service, options=opts)
+    drv.set_page_load_timeout(25)
+    drv.set_script_timeout(10)
+    # HTML и JS не трогаем — сетка дат собирается с участием скриптов
+    cdp(drv, "Network.enable", {})
+    cdp(drv, "Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return drv
+
+
+def cdp(driver: webdriver.Remote, cmd: str, params: dict) -> dict:
+    """execute_cdp_cmd, который работает и для webdriver.Remote (у него такого метода нет)."""
+    return driver.execute("executeCdpCommand", {"cmd": cmd, "params": params})["value"]
+
+
+def login(driver: webdriver.Remote) -> None:
     """Открываем страницу логина/целевую, ждём загрузку основной формы."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     driver.get(LOGIN_URL)
-    # Дадим странице стабильно прогрузиться
+    # Дадим странице стабильно прогрузиться; если куки в профиле живы и нас
+    # сразу пустили к датам — формы не будет, ждать её незачем
     try:
         WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "form"))
+            EC.presence_of_element_located(
+                (By.CSS_SELECTOR, f"form, #{SLOTS_CONTAINER}, {SLOT_CARDS_SEL}")
+            )
         )
     except Exception:
         # даже если формы нет, сохраним HTML для дебага
         logging.warning("Login page wait timeout")
 
 
+def wait_for_slots(driver: webdriver.Remote) -> None:
+    """Ждём появления сетки дат (вместо фиксированного sleep); не дождались — разбираем что есть."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    try:
+        WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, f"#{SLOTS_CONTAINER}, {SLOT_CARDS_SEL}"))
+        )
+    except Exception:
+        logging.warning("Slots wait timeout")
+
+
+def page_html(driver: webdriver.Remote) -> str:
+    """
+    HTML только контейнера с датами (CDP DOM.getOuterHTML) — в разы меньше page_source.
+    Контейнера нет (не залогинились, поменялась верстка) — весь документ.
+    """
+    try:
+        root = cdp(driver, "DOM.getDocument", {})["root"]["nodeId"]
+        node = cdp(
+            driver, "DOM.querySelector", {"nodeId": root, "selector": f"#{SLOTS_CONTAINER}"}
+        )["nodeId"]
+        if node:
+            return cdp(driver, "DOM.getOuterHTML", {"nodeId": node})["outerHTML"]
+        logging.warning("#%s не найден — берём page_source", SLOTS_CONTAINER)
+    except Exception:
+        logging.exception("CDP getOuterHTML failed")
+    return driver.page_source
+
+
 # ---------- парсинг HTML ----------
-def parse_slots_from_html(html: str) -> List[Dict]:
+def parse_slots_from_html(html: str) -> List[Slot]:
     """
     Универсальный парсер. Ищет карточки дат и их статусы.
     Подстраивается под разные варианты верстки.
 
     Возвращает список:
-    [{"date": "16 октября четверг", "status": "Свободно"|"Нет мест"}, ...]
+    [Slot(date="16 октября четверг", status="Свободно"|"Нет мест"), ...]
     """
-    # если в requirements добавили lxml — используем его. Иначе можно поставить "html.parser"
-    soup = BeautifulSoup(html, "lxml")
+    from selectolax.lexbor import LexborHTMLParser
 
-    slots: List[Dict] = []
+    # selectolax (C-движок) — без питоновской обёртки на каждый узел, как у BeautifulSoup;
+    # скрипты/стили вырезаем до парсинга — дерево строится только из разметки
+    tree = LexborHTMLParser(NOISE_RE.sub("", html))
 
-    # Попробуем сначала найти явные карточки по типичным классам
-    # (эти селекторы можно при необходимости подточить под актуальную верстку)
-    candidate_nodes = soup.select(".calendar .day, .calendar .item, .slots-list .slot, .day-item")
+    slots: List[Slot] = []
+
+    # Основная верстка: #graphic_container .graphic_item с датой и статусом в своих узлах
+    items = tree.css(GRAPHIC_ITEM_SEL)
+    if items:
+        for node in items:
+            date_node = node.css_first(GRAPHIC_DATE_SEL)
+            date = date_node.text(separator=" ", strip=True, skip_empty=True) if date_node is not None else ""
+            if not date:
+                continue
+            status_node = node.css_first(GRAPHIC_STATUS_SEL)
+            text = status_node.text(separator=" ", strip=True, skip_empty=True) if status_node is not None else ""
+            free = FREE_RE.search(text) and not BUSY_RE.search(text)
+            slots.append(Slot(date, "Свободно" if free else "Нет мест"))
+        return slots
+
+    # Иначе — явные карточки по типичным классам
+    candidate_nodes = tree.css(SLOT_CARDS_SEL)
 
     if candidate_nodes:
         for node in candidate_nodes:
-            text = node.get_text(" ", strip=True)
+            text = node.text(separator=" ", strip=True, skip_empty=True)
             if not text:
                 continue
 
             # статус
-            status = "Свободно" if ("Есть места" in text or "Доступно" in text or "Свобод" in text) else "Нет мест"
+            status = "Свободно" if FREE_RE.search(text) and not BUSY_RE.search(text) else "Нет мест"
 
             # дата — возьмём первую строчку/кусок, похожий на дату
             # часто дата крупнее и стоит в начале карточки
             # для надёжности вычленим число + месяц, остальное оставим как есть
-            date = text.split("  ")[0].strip() if "  " in text else text.splitlines()[0].strip()
+            date = DATE_SPLIT_RE.split(text, maxsplit=1)[0].strip()
             # немного подчистим мусор
-            date = date.replace("Есть места", "").replace("Нет мест", "").strip()
+            date = MARKERS_RE.sub("", date).strip()
             if date:
-                slots.append({"date": date, "status": status})
+                slots.append(Slot(date, status))
 
         return slots
 
     # Fallback: если конкретных карточек не нашли, посмотрим просто по ключевым словам
-    text = soup.get_text("\n", strip=True)
-    lines = [ln for ln in text.splitlines() if ln]
+    root = tree.body or tree.root  # <head> (title/meta) дат не содержит
+    text = root.text(separator="\n", strip=True, skip_empty=True) if root is not None else ""
+
+    for m in STATUS_LINE_RE.finditer(text):
+        ln = m.group(0)
+        if LINE_FREE_RE.search(ln) and not BUSY_RE.search(ln):
+            slots.append(Slot(ln.replace("Есть места", "").strip(), "Свободно"))
+        else:
+            slots.append(Slot(ln.replace("Нет мест", "").strip(), "Нет мест"))
+
+    return slots
+
 
-    for ln in lines:
-        if "Есть места" in ln or "Свобод" in ln:
-            slots.append({"date": ln.replace("Есть места", "").strip(), "status": "Свободно"})
-        elif "Нет мест" in ln:
-            slots.append({"date": ln.replace("Нет мест", "").strip(), "status": "Нет мест"})
+_PARSE_CACHE: dict = {}
 
+
+def parse_slots_cached(html_hash: str, html: str) -> List[Slot]:
+    """
+    Разбор с памятью на несколько последних страниц (ключ — уже посчитанный хэш HTML).
+    В долгоживущем режиме страница часто возвращается к одному из прошлых состояний.
+    """
+    slots = _PARSE_CACHE.get(html_hash)
+    if slots is None:
+        slots = parse_slots_from_html(html)
+        if len(_PARSE_CACHE) >= 8:
+            _PARSE_CACHE.pop(next(iter(_PARSE_CACHE)))  # самый старый
+        _PARSE_CACHE[html_hash] = slots
     return slots
 
 
 # ---------- основной прогон ----------
-def one_check_run() -> None:
-    driver = make_driver()
+def process_page(html: str) -> None:
+    """Разбор HTML, сравнение со снимком и уведомление."""
+    html_hash = digest(html.encode("utf-8"))
+    if html_hash == load_state(HTML_HASH_FILE):
+        logging.info("Без изменений (HTML не менялся) — разбор пропущен.")
+        return
+
+    slots = parse_slots_cached(html_hash, html)
+
+    # для логов покажем, что нашли
+    free_dates = [s.date.strip() for s in slots if s.status == "Свободно"]
+    if free_dates:
+        logging.info("===> Найдены свободные слоты: %d шт.", len(free_dates))
+        for d in free_dates:
+            logging.info("FREE_DATE: %s", d)
+    else:
+        logging.info("===> Свободных слотов нет.")
+
+    snapshot_hash = snapshot_key(slots)
+    if DEBUG_STATE:
+        with open(STATE_FILE + ".full.json", "wb") as f:
+            f.write(orjson.dumps(sorted((s.date, s.status) for s in slots)))
+
+    if snapshot_hash != load_state(STATE_FILE):
+        if SAVE_PAGE_HTML:
+            with open("page.html", "w", encoding="utf-8") as f:
+                f.write(html)
+
+        # шлём только про даты, которые освободились с прошлого раза
+        # (дату заняли или она пропала — не повод писать); ONLY_NOTIFY_WHEN_FREE=0 — про любое изменение
+        prev_free = set(filter(None, load_state(FREE_DATES_FILE).split("\n")))
+        curr_free = {d for d in free_dates if d}  # пустая дата в файл не переживёт перезагрузку
+        added = curr_free - prev_free
+        if added or (not ONLY_NOTIFY_WHEN_FREE):
+            shown = [s for s in slots if s.date.strip() in added] if ONLY_NOTIFY_WHEN_FREE else slots
+            ts = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d %H:%M")
+            text = (
+                f"🚨 Появились свободные слоты в СИЗО-11! [{ts}]\n\n"
+                f"{format_slots(shown, only_available=True)}\n\n"
+                f"Записаться тут: <a href='{TARGET_URL}'>страница записи</a>"
+            )
+            send_tg_background(text)
+
+        if curr_free != prev_free:
+            save_state(FREE_DATES_FILE, "\n".join(sorted(curr_free)))
+        save_state(STATE_FILE, snapshot_hash)  # снимок сохраняем всегда, если изменился
+    else:
+        logging.info("Без изменений (snapshot не менялся).")
+
+    save_state(HTML_HASH_FILE, html_hash)  # только после полного разбора/уведомления
+
+
+def check_via_http() -> bool:
+    """HTTP-путь (USE_REQUESTS=1). True — страница разобрана, Chrome не нужен."""
+    if not USE_REQUESTS:
+        return False
+    html = fetch_html_requests()
+    if not html:
+        return False
+    process_page(html)
+    return True
+
+
+def one_check_tick(driver: webdriver.Remote) -> None:
+    """Проверка на уже запущенном Chrome; драйвер не закрываем."""
     try:
         login(driver)
-        time.sleep(2)
+        wait_for_slots(driver)
 
-        html = driver.page_source
-        with open("page.html", "w", encoding="utf-8") as f:
-            f.write(html)
-
-        slots = parse_slots_from_html(html)
-        has_free = any(s.get("status") == "Свободно" for s in slots)
-
-        # для логов покажем, что нашли
-        free_dates = [(s.get("date") or "").strip() for s in slots if s.get("status") == "Свободно"]
-        if free_dates:
-            logging.info("===> Найдены свободные слоты: %d шт.", len(free_dates))
-            for d in free_dates:
-                logging.info("FREE_DATE: %s", d)
-        else:
-            logging.info("===> Свободных слотов нет.")
-
-        snapshot = json.dumps(slots, ensure_ascii=False, sort_keys=True)
-        last = load_last_snapshot()
-
-        if snapshot != last:
-            if has_free or (not ONLY_NOTIFY_WHEN_FREE):
-                ts = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d %H:%M")
-                text = (
-                    f"🚨 Появились свободные слоты в СИЗО-11! [{ts}]\n\n"
-                    f"{format_slots(slots, only_available=True)}\n\n"
-                    f"Записаться тут: <a href='{TARGET_URL}'>страница записи</a>"
-                )
-                send_tg(text)
-
-            save_snapshot(snapshot)  # снимок сохраняем всегда, если изменился
-        else:
-            logging.info("Без изменений (snapshot не менялся).")
+        process_page(page_html(driver))
 
     except Exception:
-        logging.exception("FATAL")
-        # Сохраним скрин и html на случай разборов в артефактах
+        # трейсбек пишет вызывающий (one_check_run / poll_forever) — здесь только артефакты.
+        # Сохраним html (и скрин, если просили) на случай разборов в артефактах
         try:
-            driver.save_screenshot("page.png")
+            if SAVE_PAGE_HTML:
+                driver.save_screenshot("page.png")
             with open("page.html", "w", encoding="utf-8") as f:
                 f.write(driver.page_source)
         except Exception:
             pass
         raise
+
+
+def one_check_run() -> None:
+    warm_tg()
+    if check_via_http():
+        return
+
+    driver = make_driver()
+    try:
+        one_check_tick(driver)
+    except Exception:
+        logging.exception("FATAL")
+        sys.exit(1)  # ненулевой код для cron/CI, без второго трейсбека от интерпретатора
     finally:
         driver.quit()
 
 
+def poll_forever() -> None:
+    """
+    Долгоживущий режим: Chrome и сессии создаются один раз и переживают тики.
+    Если умер сам браузер — пересоздаём его, с нарастающей паузой;
+    таймаут загрузки и прочие сбои — просто неудачный тик на том же Chrome.
+    """
+    from selenium.common.exceptions import (
+        InvalidSessionIdException,
+        NoSuchDriverException,
+        NoSuchWindowException,
+        SessionNotCreatedException,
+    )
+    from urllib3.exceptions import MaxRetryError, ProtocolError
+
+    # сессия мертва / Chrome не поднялся / chromedriver не отвечает (connection refused)
+    browser_dead = (
+        InvalidSessionIdException,
+        NoSuchWindowException,
+        SessionNotCreatedException,
+        NoSuchDriverException,
+        ConnectionError,
+        MaxRetryError,
+        ProtocolError,
+    )
+
+    # SIGTERM (systemd, docker stop) -> SystemExit, чтобы отработал finally ниже
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    warm_tg()
+    driver = None
+    failures = 0
+    try:
+        while True:
+            try:
+                if not check_via_http():
+                    if driver is None:
+                        driver = make_driver()
+                    one_check_tick(driver)
+                failures = 0
+            except browser_dead:
+                failures += 1
+                logging.exception("Chrome упал — пересоздадим (попытка %d)", failures)
+                if driver is not None:
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+                    driver = None
+            except Exception:
+                logging.exception("Check failed")
+
+            time.sleep(CHECK_INTERVAL * 2 ** min(failures, 5))
+    finally:
+        # Ctrl-C / SIGTERM — не оставляем Chrome висеть
+        if driver is not None:
+            driver.quit()
+
+
 if __name__ == "__main__":
-    one_check_run()
+    if CHECK_INTERVAL > 0:
+        poll_forever()
+    else:
+        one_check_run()